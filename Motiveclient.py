@@ -1,16 +1,200 @@
+import os
 import time
 import socket
 import struct
 from threading import Thread
 import coloredlogs, logging
 
+# NumPy and Numba are optional; without them packets are parsed in Python.
+try:
+  import numpy as np
+except ImportError:
+  np = None
+try:
+  from numba import njit
+except ImportError:
+  njit = None
+
+# module logger; messages use %-style arguments so they are only formatted
+# when a handler actually emits them
+log = logging.getLogger(__name__)
+
 
 # Create structs for reading various object types to speed up parsing.
-Vector3 = struct.Struct('<fff')
-Quaternion = struct.Struct('<ffff')
 IntValue = struct.Struct('<i')
-FloatValue = struct.Struct('<f')
-DoubleValue = struct.Struct('<d')
+
+# Bound unpack_from method, so each count is read with a single C-level call
+# straight out of the packet buffer instead of slicing it first.
+_I = IntValue.unpack_from
+
+# Fixed-layout runs of the frame-of-data packet, decoded in one call each.
+# message ID, Num bytes in payload ---uint16_t
+MessageHeader = struct.Struct('<HH')
+# frame number, marker set count ---int32_t
+FrameHeader = struct.Struct('<ii')
+# skeleton count (skipped), labeled marker count ---int32_t
+SkeletonLabeledCounts = struct.Struct('<4xi')
+# force plate count, device count ---int32_t; timecode, timecode sub ---uint32_t
+# all skipped, then the timestamp ---double
+FrameTrailer = struct.Struct('<16xd')
+# unused fields after the timestamp: mid cam exposure, camera data received
+# and transmit timestamps ---double, frame parameters ---int16_t
+FRAME_TRAILER_UNUSED = 3 * 8 + 2
+
+# Sizes of the repeated records in the frame-of-data packet.
+# marker in a marker set, unlabeled marker ---3 float position
+MARKER_STRIDE = 12
+UNLABELED_STRIDE = 12
+# labeled marker ---int32_t id, 3 float position, float size,
+# int16_t params, float residual
+LABELED_STRIDE = 26
+# rigid body ---int32_t id, 3 float position, 4 float orientation,
+# float mean marker error, int16_t tracking status
+RIGIDBODY_STRIDE = 38
+# smallest marker set ---empty model name, int32_t marker count
+MARKERSET_MIN_STRIDE = 1 + 4
+# bytes of fixed-size fields that must still follow each counted block,
+# so a count can be checked against the packet length before it is used
+LABELED_SUFFIX = FrameTrailer.size + FRAME_TRAILER_UNUSED
+RIGIDBODY_SUFFIX = SkeletonLabeledCounts.size + LABELED_SUFFIX
+UNLABELED_SUFFIX = 4 + RIGIDBODY_SUFFIX
+MARKERSET_SUFFIX = 4 + UNLABELED_SUFFIX
+
+
+def checkCount(data, offset, count, stride, suffix, name):
+  # raise if count records, and the fixed fields after them, do not fit in
+  # what is left of the packet
+  if count < 0 or count * stride + suffix > len(data) - offset:
+    raise ValueError("{} {} do not fit in the remaining {} bytes".format(
+        count, name, len(data) - offset))
+
+
+# Parsers for the rigid body block, generated for each rigid body count seen.
+# A given Motive setup streams a fixed set of rigid bodies, so after the first
+# frame every packet is parsed by the same straight-line function that reads
+# the whole block with one Struct and builds the result tuples without a loop.
+_rigidBodyParsers = {}
+
+def rigidBodyParser(count):
+  # returns parse(data, offset) -> (ids, positions, orientations) for a block
+  # of count rigid bodies starting at offset
+  parser = _rigidBodyParsers.get(count)
+  if parser is not None:
+    return parser
+  # id, position, orientation, then skip mean marker error and tracking status
+  block = struct.Struct('<' + 'i3f4f6x' * count)
+  ids, positions, orientations, fields = [], [], [], []
+  for i in range(count):
+    position = ["px{}".format(i), "py{}".format(i), "pz{}".format(i)]
+    orientation = ["qx{}".format(i), "qy{}".format(i), "qz{}".format(i),
+                   "qw{}".format(i)]
+    ids.append("id{}".format(i))
+    positions.append("({},)".format(", ".join(position)))
+    orientations.append("({},)".format(", ".join(orientation)))
+    fields += [ids[-1]] + position + orientation
+  source = "def parse(data, offset):\n"
+  if count:
+    source += "  {}, = unpack(data, offset)\n".format(", ".join(fields))
+  source += "  return ({}), ({}), ({})\n".format(
+      "".join(name + ", " for name in ids),
+      "".join(name + ", " for name in positions),
+      "".join(name + ", " for name in orientations))
+  namespace = {'unpack': block.unpack_from}
+  exec(compile(source, "<rigidBodyParser {}>".format(count), 'exec'),
+       namespace)
+  parser = _rigidBodyParsers[count] = namespace['parse']
+  return parser
+
+if np is not None:
+  # one rigid body record as packed on the wire (38 bytes, no padding):
+  # id ---int32_t, position ---3 float, orientation ---4 float,
+  # mean marker error ---float, tracking status ---int16_t
+  RigidBodyRecord = np.dtype([('id', '<i4'), ('pos', '<3f4'),
+                              ('quat', '<4f4'), ('err', '<f4'),
+                              ('ts', '<i2')], align=False)
+
+
+if njit is not None:
+  # Numba versions of the frame-of-data parsing, working on the packet as a
+  # uint8 array so the steady-state parse runs without the interpreter.
+  @njit(cache=True)
+  def _readInt32(packet, offset):
+    return packet[offset:offset + 4].view(np.int32)[0]
+
+  @njit(cache=True)
+  def _readFloat32(packet, offset):
+    return packet[offset:offset + 4].view(np.float32)[0]
+
+  @njit(cache=True)
+  def _readFloat64(packet, offset):
+    return packet[offset:offset + 8].view(np.float64)[0]
+
+  @njit(cache=True)
+  def _unpackMotiveDataJit(packet, offset, ids, positions, orientations):
+    # same layout as MotiveClient.unpackMotiveData; the rigid bodies are
+    # written into the preallocated output arrays as long as they fit.
+    # returns (frameNumber, rigidBodyCount, timestamp), with a rigidBodyCount
+    # of -1 if any count does not fit in the packet. Numba does no bounds
+    # checking, so every count is checked before it is used.
+    size = packet.shape[0]
+    if size - offset < 8 + MARKERSET_SUFFIX:
+      return 0, -1, 0.0
+    frameNumber = _readInt32(packet, offset)
+    markerSetCount = _readInt32(packet, offset + 4)
+    offset += 8
+    if markerSetCount < 0 or \
+        markerSetCount * MARKERSET_MIN_STRIDE + MARKERSET_SUFFIX > size - offset:
+      return frameNumber, -1, 0.0
+
+    # Marker sets: nul terminated model name, marker count, markers
+    for i in range(markerSetCount):
+      while offset < size and packet[offset] != 0:
+        offset += 1
+      offset += 1
+      if size - offset < 4 + MARKERSET_SUFFIX:
+        return frameNumber, -1, 0.0
+      markerCount = _readInt32(packet, offset)
+      offset += 4
+      if markerCount < 0 or \
+          markerCount * MARKER_STRIDE + MARKERSET_SUFFIX > size - offset:
+        return frameNumber, -1, 0.0
+      offset += MARKER_STRIDE * markerCount
+
+    # Unlabeled markers
+    unlabeledMarkersCount = _readInt32(packet, offset)
+    offset += 4
+    if unlabeledMarkersCount < 0 or \
+        unlabeledMarkersCount * UNLABELED_STRIDE + UNLABELED_SUFFIX > \
+        size - offset:
+      return frameNumber, -1, 0.0
+    offset += UNLABELED_STRIDE * unlabeledMarkersCount
+
+    # Rigid bodies: id, position, orientation, mean error, tracking status
+    rigidBodyCount = _readInt32(packet, offset)
+    offset += 4
+    if rigidBodyCount < 0 or \
+        rigidBodyCount * RIGIDBODY_STRIDE + RIGIDBODY_SUFFIX > size - offset:
+      return frameNumber, -1, 0.0
+    for i in range(rigidBodyCount):
+      if i < ids.shape[0]:
+        ids[i] = _readInt32(packet, offset)
+        for j in range(3):
+          positions[i, j] = _readFloat32(packet, offset + 4 + 4 * j)
+        for j in range(4):
+          orientations[i, j] = _readFloat32(packet, offset + 16 + 4 * j)
+      offset += RIGIDBODY_STRIDE
+
+    # Skeletons, labeled markers, force plates, devices, timecode
+    labeledMarkerCount = _readInt32(packet, offset + 4)
+    offset += 8
+    if labeledMarkerCount < 0 or \
+        labeledMarkerCount * LABELED_STRIDE + LABELED_SUFFIX > size - offset:
+      return frameNumber, -1, 0.0
+    offset += LABELED_STRIDE * labeledMarkerCount
+    offset += 16
+
+    timestamp = _readFloat64(packet, offset)
+    return frameNumber, rigidBodyCount, timestamp
 
 
 # use your client IP address
@@ -24,21 +208,66 @@ multiCastAddress = "239.255.42.99"
 # Client/server message id for each NatNet message (as in NatNetTypes.h)
 NAT_FRAMEOFDATA = 7
 
+# largest datagram buffer needed, the UDP payload limit rounded up to 2**16
+MAX_DATAGRAM_SIZE = 65536
+# flag for non-blocking reads on a blocking socket; not available on Windows,
+# where the socket is switched to non-blocking around the drain instead
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
 class MotiveClient:
   # constructor 
   def __init__(self):
     self.multicastAddress = multiCastAddress
     # specifies the port to be used for streaming data from the server to the client
     self.dataPort = 1511
+    # kernel receive buffer requested for the data socket (12 MiB), large
+    # enough to absorb Motive frame bursts while the data thread is busy.
+    # Linux caps the request at net.core.rmem_max, so it may need raising:
+    #   sudo sysctl -w net.core.rmem_max=12582912
+    self.receiveBufferSize = 12 * 1024 * 1024
+    # maximum number of datagrams drained from the socket in one batch
+    self.maxBatchPackets = 8
+    # CPU the data thread is pinned to, and the SCHED_FIFO priority (e.g. 20)
+    # requested for it; None leaves either unchanged. Both only apply on
+    # Linux; real-time scheduling needs CAP_SYS_NICE, e.g.
+    #   sudo setcap cap_sys_nice+ep $(readlink -f $(which python3))
+    # otherwise the thread falls back to nice -10, then to the default.
+    self.dataThreadCPU = None
+    self.dataThreadPriority = None
+    # preallocated datagram buffers reused for every batch, and views of them
+    # that are sliced to the received length instead of copying the payload.
+    # They are sized for the largest UDP datagram, so none is ever truncated.
+    self._bufs = [bytearray(MAX_DATAGRAM_SIZE)
+                  for i in range(self.maxBatchPackets)]
+    self._views = [memoryview(buf) for buf in self._bufs]
+    # user callbacks for rigid body data:
+    # rigidBodyClient(id, position, orientation) is called for every rigid body,
+    # rigidBodyBatchClient(ids, positions, orientations) is called once per
+    # frame with int32[N], float32[N, 3] and float32[N, 4] NumPy arrays.
+    # The arrays are only valid during the call, copy them to keep the data.
+    self.rigidBodyClient = None
+    self.rigidBodyBatchClient = None
+    # parse frames with the Numba kernel (opt-in, requires Numba); it is
+    # compiled by run() before the data thread starts
+    self.useNumba = False
     # Logging
     coloredlogs.install(level='INFO', fmt='MotiveDATA: %(message)s',
                           level_styles={'info': {'color': 'red'}})
+    # checked once here so the per-packet and per-rigid-body log lines
+    # cost a single attribute test when INFO is disabled
+    self.logInfo = log.isEnabledFor(logging.INFO)
 
   def run(self):
     # Data socket and thread
     self.dataSocket = self.createSocket(self.dataPort)
     if self.dataSocket is None:
       raise RuntimeError("Could not open data channel")
+    if self.rigidBodyBatchClient is not None and np is None:
+      raise RuntimeError("rigidBodyBatchClient requires NumPy")
+    if self.useNumba:
+      if njit is None:
+        raise RuntimeError("useNumba requires Numba")
+      self.compileNumba()
     dataThread = Thread(target=self.threadFunction, args=(self.dataSocket,))
 
     dataThread.start()
@@ -50,26 +279,105 @@ class MotiveClient:
                            socket.SOCK_DGRAM,
                            socket.IPPROTO_UDP)  # UDP
     newSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    # Specify my_ip as the interface to subscribe to multicast through
-    newSocket.setsockopt(socket.SOL_IP, socket.IP_ADD_MEMBERSHIP,
-                      socket.inet_aton(self.multicastAddress)
-                      + socket.inet_aton(myIP))
-
-
-    newSocket.bind((self.multicastAddress, port))
+    # let several clients on this host listen to the same stream
+    if hasattr(socket, 'SO_REUSEPORT'):
+      newSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # Enlarge the kernel receive buffer so bursts are not dropped
+    newSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                      self.receiveBufferSize)
+    # the kernel may grant less (or, on Linux, report double) what was asked
+    receiveBufferSize = newSocket.getsockopt(socket.SOL_SOCKET,
+                                             socket.SO_RCVBUF)
+    log.info("Receive buffer size: %d bytes", receiveBufferSize)
+    if receiveBufferSize < self.receiveBufferSize:
+      log.warning("Receive buffer is smaller than the requested %d bytes,"
+                  " raise net.core.rmem_max", self.receiveBufferSize)
+    # Specify my_ip as the interface to subscribe to multicast through,
+    # packed as struct ip_mreq (group address, interface address)
+    membership = struct.pack('4s4s', socket.inet_aton(self.multicastAddress),
+                             socket.inet_aton(myIP))
+    newSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                      membership)
+    # keep multicast loopback on, so a Motive instance on this host is
+    # delivered locally rather than through the NIC
+    newSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+    # bind to all interfaces; binding to the group address fails on Windows
+    newSocket.bind(('', port))
     return newSocket
 
   
+  def setThreadPriority(self):
+    # called from the data thread; on Linux pid 0 is the calling thread
+    # failures are logged and the thread keeps the default scheduling
+    if self.dataThreadCPU is not None and hasattr(os, 'sched_setaffinity'):
+      try:
+        os.sched_setaffinity(0, {self.dataThreadCPU})
+      except OSError as e:
+        log.warning("Could not pin the data thread to CPU %s: %s",
+                    self.dataThreadCPU, e)
+    if self.dataThreadPriority is None or \
+        not hasattr(os, 'sched_setscheduler'):
+      return
+    try:
+      os.sched_setscheduler(0, os.SCHED_FIFO,
+                            os.sched_param(self.dataThreadPriority))
+    except PermissionError:
+      try:
+        os.nice(-10)
+      except PermissionError:
+        log.warning("Could not raise the data thread priority,"
+                    " CAP_SYS_NICE is missing")
+    except OSError as e:
+      log.warning("Could not set data thread priority %s: %s",
+                  self.dataThreadPriority, e)
+
   def threadFunction(self, socket):
-    # receive data from the socket. 
-    # the return value is a pair (bytes, address) where bytes is 
-    # a bytes object representing the data received
+    self.setThreadPriority()
+    # receive data from the socket into the preallocated buffers. 
+    # the return value is a pair (nbytes, address) where nbytes is 
+    # the number of bytes written into the buffer
     # and address is the address of the socket sending the data
+    # everything used per packet is bound to locals up front, so the loop
+    # does no attribute lookups
+    recv = socket.recvfrom_into
+    setblocking = socket.setblocking
+    parse = self.parseMessage
+    bufs = self._bufs
+    views = self._views
+    maxBatchPackets = self.maxBatchPackets
+    toggleBlocking = not MSG_DONTWAIT
+    sizes = [0] * maxBatchPackets
     while True:
-      # Block for input
-      data, addr = socket.recvfrom(32768)  # 32k byte buffer size
-      if len(data) > 0:
-        self.parseMessage(data)
+      # Block for input; errors are logged and the loop keeps going, unless
+      # the socket has been closed
+      try:
+        if toggleBlocking:
+          setblocking(True)
+        sizes[0], addr = recv(bufs[0])
+      except OSError as e:
+        if socket.fileno() < 0:
+          return
+        log.warning("Receive failed: %s", e)
+        # back off so a persistent error does not spin the thread
+        time.sleep(0.1)
+        continue
+      count = 1
+      # then drain whatever else is already queued without blocking,
+      # so back-to-back frames leave the kernel buffer before parsing
+      try:
+        if toggleBlocking:
+          setblocking(False)
+        while count < maxBatchPackets:
+          sizes[count], addr = recv(bufs[count], 0, MSG_DONTWAIT)
+          count += 1
+      except BlockingIOError:
+        pass
+      except OSError as e:
+        log.warning("Receive failed: %s", e)
+
+      for i in range(count):
+        parse(views[i][:sizes[i]])
 
   # initial console messages and message parsing
   def parseMessage(self, data):
@@ -79,131 +387,201 @@ class MotiveClient:
     # in advance to accessing the actual tracking data.
     # In this function we only access the frame-specific tracking data using messageID = NAT_FRAMEOFDATA.
         
-    logging.info("\n------------\nBegin Packet")
-
-    # message ID (e.g. NAT_FRAMEOFDATA) ---uint16_t
-    messageID = int.from_bytes(data[0:2], byteorder='little')
-    logging.info("Message ID: {}".format(messageID))
-    # Skip the getting Num bytes in payload (packet size) ---uint16_t
-    offset = 4
+    log.debug("\n------------\nBegin Packet")
+
+    # message ID (e.g. NAT_FRAMEOFDATA) and Num bytes in payload ---uint16_t
+    try:
+      messageID, packetSize = MessageHeader.unpack_from(data, 0)
+    except struct.error:
+      log.warning("Dropping packet of %d bytes without a header", len(data))
+      return
+    offset = MessageHeader.size
+    if self.logInfo:
+      log.info("Message ID: %d", messageID)
+    # drop truncated packets before walking past the end of the buffer
+    if packetSize + offset != len(data):
+      log.warning("Packet size mismatch: header %d bytes, received %d",
+                  packetSize + offset, len(data))
+      return
     if messageID == NAT_FRAMEOFDATA:
-      self.unpackMotiveData(data[offset:])
+      try:
+        if self.useNumba:
+          rigidBodies, rigidBodyArrays = self.unpackMotiveDataNumba(data,
+                                                                    offset)
+        else:
+          rigidBodies, rigidBodyArrays = self.unpackMotiveData(data, offset)
+      except (ValueError, IndexError, struct.error) as e:
+        log.warning("Dropping malformed packet: %s", e)
+      else:
+        # the callbacks run outside the handler, so errors raised in user
+        # code are not mistaken for malformed packets
+        self.deliverRigidBodies(rigidBodies, rigidBodyArrays)
     else:
-      logging.info("ERROR: Unrecognized packet type")
-
-    logging.info("End Packet\n----------")
+      log.info("ERROR: Unrecognized packet type")
+
+    log.debug("End Packet\n----------")
+
+  def deliverRigidBodies(self, rigidBodies, rigidBodyArrays):
+    # rigidBodies is (ids, positions, orientations) for rigidBodyClient and
+    # rigidBodyArrays the same as NumPy arrays for rigidBodyBatchClient;
+    # either is None when its client is not set
+    if rigidBodies is not None and self.rigidBodyClient is not None:
+      for rigidBodyID, rigidBodyPositon, rigidBodyOrientation in zip(
+          *rigidBodies):
+        self.rigidBodyClient(rigidBodyID, rigidBodyPositon,
+                             rigidBodyOrientation)
+    if rigidBodyArrays is not None:
+      self.rigidBodyBatchClient(*rigidBodyArrays)
 
   # depacketizing Motive data packets directly as in NatNetTypes.h  
-  def unpackMotiveData(self, data):
-    data = memoryview(data)
-    offset = 0
-
-    # Frame number (4 bytes)
-    frameNumber = int.from_bytes(data[offset:offset + 4], byteorder='little')
-    offset += 4
-    logging.info("Frame: {}".format(frameNumber))
+  # every helper below reads from the one packet buffer at an absolute
+  # offset, returning the offset it stopped at.
+  # unpackMotiveData only decodes; it returns the rigid bodies as
+  # (rigidBodies, rigidBodyArrays) for deliverRigidBodies
+  def unpackMotiveData(self, data, offset):
+
+    # Frame number and marker set count (4 bytes each)
+    frameNumber, markerSetCount = FrameHeader.unpack_from(data, offset)
+    offset += FrameHeader.size
+    if self.logInfo:
+      log.info("Frame: %d", frameNumber)
     
     # Marker sets
-    markerSetCount = int.from_bytes(data[offset:offset + 4], byteorder='little')
-    offset += 4
+    checkCount(data, offset, markerSetCount, MARKERSET_MIN_STRIDE,
+               MARKERSET_SUFFIX, "marker sets")
     for i in range(markerSetCount):
-      offset += self.unpackMarkerSet(data[offset:])
+      offset = self.unpackMarkerSet(data, offset)
 
     # Unlabeled markers int32_t
-    unlabeledMarkersCount = int.from_bytes(data[offset:offset + 4],
-                                           byteorder='little')
+    (unlabeledMarkersCount,) = _I(data, offset)
     offset += 4
+    checkCount(data, offset, unlabeledMarkersCount, UNLABELED_STRIDE,
+               UNLABELED_SUFFIX, "unlabeled markers")
     # Just skip them
-    offset += 12 * unlabeledMarkersCount
+    offset += UNLABELED_STRIDE * unlabeledMarkersCount
 
     # Rigid bodies int32_t
-    rigidBodyCount = int.from_bytes(data[offset:offset + 4], byteorder='little')
-    offset += 4
-    logging.info("Rigid Body Count: {}".format(rigidBodyCount))
-    for i in range(rigidBodyCount):
-      offset += self.unpackRigidBodyData(data[offset:])
-
-    # Skeletons int32_t
-    # Just skip them
-    offset += 4
-
-    #  Labeled markers int32_t
-    # Just skip them
-    labeledMarkerCount = 0
-    labeledMarkerCount = int.from_bytes(data[offset:offset + 4],byteorder='little')
+    (rigidBodyCount,) = _I(data, offset)
     offset += 4
-    offset += 26*labeledMarkerCount
-
-    # Force Plate data int32_t
-    # Just skip them
-    offset += 4
-
-    # Device data int32_t
-    # Just skip them
-    offset += 4
-    
-    # Timecode uint32_t 
-    # Just skip them
-    offset += 4
-    # timecode Sub uint32_t 
-    # Just skip them
-    offset += 4
-
-    # Timestamp double
-    timestamp, = DoubleValue.unpack(data[offset:offset + 8])
-    offset += 8
-    logging.info("Timestamp: {}".format(timestamp))
-
-    # skip mid cam exposure time stamp double
-    offset += 8
-    # skip Camera data received timestamp double
-    offset += 8
-    # skip Transmit timestamp double
-    offset += 8
-
-    # Frame parameters int16_t
+    checkCount(data, offset, rigidBodyCount, RIGIDBODY_STRIDE,
+               RIGIDBODY_SUFFIX, "rigid bodies")
+    if self.logInfo:
+      log.info("Rigid Body Count: %d", rigidBodyCount)
+    rigidBodies = rigidBodyArrays = None
+    if self.logInfo or self.rigidBodyClient is not None:
+      rigidBodies = self.unpackRigidBodyData(data, offset, rigidBodyCount)
+    if self.rigidBodyBatchClient is not None:
+      # the whole block as one record array; the columns are views of it
+      records = np.frombuffer(data, dtype=RigidBodyRecord,
+                              count=rigidBodyCount, offset=offset)
+      rigidBodyArrays = (records['id'], records['pos'], records['quat'])
+    offset += rigidBodyCount * RIGIDBODY_STRIDE
+
+    # Skeletons and labeled markers int32_t
     # Just skip them
-    offset += 2
-
-  def unpackMarkerSet(self, data):
+    (labeledMarkerCount,) = SkeletonLabeledCounts.unpack_from(data, offset)
+    offset += SkeletonLabeledCounts.size
+    checkCount(data, offset, labeledMarkerCount, LABELED_STRIDE,
+               LABELED_SUFFIX, "labeled markers")
+    offset += LABELED_STRIDE * labeledMarkerCount
+
+    # Force Plate data, Device data, Timecode and timecode Sub are skipped,
+    # Timestamp double is the last field used; the rest of the packet is not
+    (timestamp,) = FrameTrailer.unpack_from(data, offset)
+    if self.logInfo:
+      log.info("Timestamp: %s", timestamp)
+
+    return rigidBodies, rigidBodyArrays
+
+  def compileNumba(self):
+    # allocate the kernel's output arrays, which grow to the largest rigid
+    # body count seen, and compile the kernel on an empty frame so the first
+    # real packet does not stall the data thread
+    self._allocateRigidBodyArrays(16)
+    packet = np.zeros(MessageHeader.size + 8 + MARKERSET_SUFFIX, dtype=np.uint8)
+    _unpackMotiveDataJit(packet, MessageHeader.size, self._ids,
+                         self._positions, self._orientations)
+
+  def _allocateRigidBodyArrays(self, size):
+    self._ids = np.zeros(size, dtype=np.int32)
+    self._positions = np.zeros((size, 3), dtype=np.float32)
+    self._orientations = np.zeros((size, 4), dtype=np.float32)
+
+  def unpackMotiveDataNumba(self, data, offset):
+    # same as unpackMotiveData, with the parsing done by _unpackMotiveDataJit;
+    # only the logging and the conversion for the callbacks are left in Python
+    packet = np.frombuffer(data, dtype=np.uint8)
+    frameNumber, rigidBodyCount, timestamp = _unpackMotiveDataJit(
+        packet, offset, self._ids, self._positions, self._orientations)
+    if rigidBodyCount < 0:
+      raise ValueError("counts do not fit in the packet")
+    if rigidBodyCount > len(self._ids):
+      self._allocateRigidBodyArrays(rigidBodyCount)
+      frameNumber, rigidBodyCount, timestamp = _unpackMotiveDataJit(
+          packet, offset, self._ids, self._positions, self._orientations)
+
+    if self.logInfo:
+      log.info("Frame: %d", frameNumber)
+      log.info("Rigid Body Count: %d", rigidBodyCount)
+
+    rigidBodies = rigidBodyArrays = None
+    if self.logInfo or self.rigidBodyClient is not None:
+      # convert the whole frame at once rather than row by row
+      rigidBodies = (self._ids[:rigidBodyCount].tolist(),
+                     list(map(tuple,
+                              self._positions[:rigidBodyCount].tolist())),
+                     list(map(tuple,
+                              self._orientations[:rigidBodyCount].tolist())))
+      if self.logInfo:
+        for rigidBodyID, rigidBodyPositon, rigidBodyOrientation in zip(
+            *rigidBodies):
+          log.info("\tID: %d", rigidBodyID)
+          log.info("\t\tPosition: %s", rigidBodyPositon)
+          log.info("\t\tOrientation: %s", rigidBodyOrientation)
+    if self.rigidBodyBatchClient is not None:
+      rigidBodyArrays = (self._ids[:rigidBodyCount],
+                         self._positions[:rigidBodyCount],
+                         self._orientations[:rigidBodyCount])
+
+    if self.logInfo:
+      log.info("Timestamp: %s", timestamp)
+
+    return rigidBodies, rigidBodyArrays
+
+  def unpackMarkerSet(self, data, offset):
     # as in NatNetTypes.h 
-    offset = 0
-    # Model name
-    modelName, separator, remainder = bytes(data[offset:]).partition(b'\0')
-    offset += len(modelName) + 1
+    # Model name, nul terminated; scanned in place rather than copying
+    # the rest of the packet to find the terminator
+    end = offset
+    while data[end]:
+      end += 1
+    offset = end + 1
     # Marker count
-    markerCount = int.from_bytes(data[offset:offset + 4], byteorder='little')
+    (markerCount,) = _I(data, offset)
     offset += 4
+    checkCount(data, offset, markerCount, MARKER_STRIDE, MARKERSET_SUFFIX,
+               "markers")
     # Markers
-    offset += 12*markerCount
+    offset += MARKER_STRIDE * markerCount
     return offset
 
-  def unpackRigidBodyData(self, data):
-    # as in NatNetTypes.h
-    offset = 0
+  def unpackRigidBodyData(self, data, offset, rigidBodyCount):
+    # as in NatNetTypes.h, each rigid body is
     # rigidBody identifier 4 bytes--- int32_t
-    rigidBodyID = int.from_bytes(data[offset:offset + 4], byteorder='little')
-    offset += 4
-    logging.info("\tID: {}".format(rigidBodyID))
-
-    # position of the rigid body
-    # each postion value occupies 4 bytes---float
-    rigidBodyPositon = Vector3.unpack(data[offset:offset + 12])
-    offset += 12
-    logging.info("\t\tPosition: {}".format(rigidBodyPositon))
-
+    # position of the rigid body, each postion value occupies 4 bytes---float
     # orientation of the rigid body---float
-    rigidBodyOrientation = Quaternion.unpack(data[offset:offset + 16])
-    offset += 16
-    logging.info("\t\tOrientation: {}".format(rigidBodyOrientation))
-
-    # skip the Mean marker error
-    offset += 4
-
-    # skip the tracking status info
-    offset += 2
-
-    return offset
+    # Mean marker error---float and tracking status info---int16_t, skipped
+    # returns the (ids, positions, orientations) tuples of the block
+    rigidBodies = rigidBodyParser(rigidBodyCount)(data, offset)
+
+    if self.logInfo:
+      for rigidBodyID, rigidBodyPositon, rigidBodyOrientation in zip(
+          *rigidBodies):
+        log.info("\tID: %d", rigidBodyID)
+        log.info("\t\tPosition: %s", rigidBodyPositon)
+        log.info("\t\tOrientation: %s", rigidBodyOrientation)
+
+    return rigidBodies
 
 
 if __name__ == "__main__":